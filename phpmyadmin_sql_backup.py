@@ -23,137 +23,512 @@
 #
 # Christoph Haunschmidt, started 2016-03
 
-import argparse
+import codecs
 import datetime
+import html
+import itertools
 import os
 import re
 import sys
-from itertools import product
-from urllib.parse import urljoin
-
-import requests
-from lxml import html
+import zlib
+from urllib.parse import unquote, urljoin, urlsplit
 
 __version__ = '2024-12-01'
 
-CONTENT_DISPOSITION_FILENAME_RE = re.compile(r'^.*filename="(?P<filename>[^"]+)".*$')
+CONTENT_DISPOSITION_FILENAME_EXT_RE = re.compile(r"filename\*=(?P<charset>[\w!#$%&+^`{}~-]+)'[^']*'(?P<filename>[^;\s]+)",
+                                                 re.IGNORECASE)
+CONTENT_TYPE_CHARSET_RE = re.compile(r'charset=["\']?(?P<charset>[\w.:-]+)', re.IGNORECASE)
 DEFAULT_PREFIX_FORMAT = r'%Y-%m-%d--%H-%M-%S-UTC_'
+LOGIN_SUCCESS_HREF_SUBSTRINGS = ('frame_content', 'server_export.php', 'index.php?route=/server/export')
+LOGIN_SUCCESS_HREF_RE = re.compile('|'.join(map(re.escape, LOGIN_SUCCESS_HREF_SUBSTRINGS)))
+EXPORT_URL_SUBSTRINGS = ('server_export.php', 'index.php?route=/server/export')
+DEFAULT_EXPORT_URL = 'index.php?route=/server/export'
+LOGIN_COOKIE_PREFIX = 'pmaAuth-'
+LOGIN_FORM_MARKER_RE = re.compile(rb'id=["\']?login_form\b')
+LOGIN_ERROR_RE = re.compile(rb'<div[^>]*\bclass=["\'][^"\']*(?<![\w-])(?:alert-danger|error)(?![\w-])[^>]*>'
+                            rb'(?P<message>.*?)</div>', re.IGNORECASE | re.DOTALL)
+HTML_TAG_RE = re.compile(rb'<[^>]*>')
+# links made of plain path segments (no empty, '.' or '..' ones) and an optional query, which resolve by concatenation
+PLAIN_URL_REF_RE = re.compile(r'/?[\w~%+,=&-]+(?:\.[\w~%+,=&-]+)*(?:/[\w~%+,=&-]+(?:\.[\w~%+,=&-]+)*)*/?'
+                              r'(?:\?[^\x00-\x20\x7f#]+)?\Z', re.ASCII)
+UNSAFE_BASE_URL_RE = re.compile(r'[\x00-\x20\x7f;]')
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+HTML_CHUNK_SIZE = 1 << 16
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_MAX_RESUMES = 3
+HTML_PARSERS = {}
+
+# requests, lxml and the optional selectolax / pyahocorasick modules are heavy to import, so they and
+# everything built from them are only set up by load_dependencies(), which the entry points download_sql_backup()
+# and is_login_successful() call; the helpers below rely on it having run
+requests = etree = ProtocolError = ReadTimeoutError = LexborHTMLParser = None
+ANCHOR_HREFS_XPATH = EXPORT_URL_XPATH = HIDDEN_INPUTS_XPATH = OPTION_VALUES_XPATH = None
+LOGIN_SUCCESS_HREF_AUTOMATON = HTTP_ADAPTER = None
+
+
+def load_dependencies():
+    global requests, etree, ProtocolError, ReadTimeoutError, LexborHTMLParser
+    global ANCHOR_HREFS_XPATH, EXPORT_URL_XPATH, HIDDEN_INPUTS_XPATH, OPTION_VALUES_XPATH
+    global LOGIN_SUCCESS_HREF_AUTOMATON, HTTP_ADAPTER
+    if HTTP_ADAPTER is not None:
+        return
+
+    import requests
+    from lxml import etree
+    from requests.adapters import HTTPAdapter
+    from urllib3.exceptions import ProtocolError, ReadTimeoutError
+    from urllib3.util.retry import Retry
+
+    try:
+        # optional, lexbor based parser which is considerably faster than lxml for the few lookups needed here
+        from selectolax.lexbor import LexborHTMLParser
+    except ImportError:
+        LexborHTMLParser = None
+
+    try:
+        # optional, C implementation of Aho-Corasick used to look for all login markers in a single scan
+        import ahocorasick
+    except ImportError:
+        LOGIN_SUCCESS_HREF_AUTOMATON = None
+    else:
+        LOGIN_SUCCESS_HREF_AUTOMATON = ahocorasick.Automaton()
+        for substring in LOGIN_SUCCESS_HREF_SUBSTRINGS:
+            LOGIN_SUCCESS_HREF_AUTOMATON.add_word(substring, substring)
+        LOGIN_SUCCESS_HREF_AUTOMATON.make_automaton()
+
+    ANCHOR_HREFS_XPATH = etree.XPath("//a/@href")
+    EXPORT_URL_XPATH = etree.XPath("id('topmenu')//a[contains(@href,'server_export.php') or "
+                                   "contains(@href,'index.php?route=/server/export')]/@href")
+    HIDDEN_INPUTS_XPATH = etree.XPath(".//input[@type='hidden' and @name!='']")
+    OPTION_VALUES_XPATH = etree.XPath("./option/@value")
+
+    # shared by all sessions so that connections to the same server are kept alive between calls;
+    # only idempotent requests (the page loads, not the form submissions) are retried
+    HTTP_ADAPTER = HTTPAdapter(pool_connections=1, pool_maxsize=8,
+                               max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                                                 raise_on_status=False))
+
+
+def response_encoding(response):
+    content_type = response.headers.get('Content-Type', '')
+    charset_match = CONTENT_TYPE_CHARSET_RE.search(content_type)
+    if charset_match:
+        try:
+            codecs.lookup(charset_match.group('charset'))
+        except LookupError:
+            # unknown charset announced by the server, fall back to phpMyAdmin's default
+            pass
+        else:
+            # keep the name as sent, libxml2 does not know all of Python's normalized codec names
+            return charset_match.group('charset')
+    return 'utf-8'
+
+
+def create_html_parser(parser_class, encoding, **kwargs):
+    try:
+        return parser_class(encoding=encoding, remove_comments=True, remove_pis=True, **kwargs)
+    except LookupError:
+        # charset known to Python but not to libxml2
+        return parser_class(encoding='utf-8', remove_comments=True, remove_pis=True, **kwargs)
+
+
+def parse_html(response):
+    encoding = response_encoding(response)
+    parser = HTML_PARSERS.get(encoding)
+    if parser is None:
+        parser = HTML_PARSERS[encoding] = create_html_parser(etree.HTMLParser, encoding)
+
+    tree = etree.fromstring(response.content, parser)
+    if tree is None:
+        raise ValueError(f"Received an empty document from {response.url}")
+    return tree
+
+
+def decode_html(response):
+    return response.content.decode(response_encoding(response), 'replace')
+
+
+def iter_html_elements(response, tags):
+    parser = create_html_parser(etree.HTMLPullParser, response_encoding(response), events=('end',), tag=tags)
+    content = response.content
+    for offset in range(0, len(content), HTML_CHUNK_SIZE):
+        parser.feed(content[offset:offset + HTML_CHUNK_SIZE])
+        for _, element in parser.read_events():
+            yield element
+
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        # empty document, nothing left to report
+        return
+    for _, element in parser.read_events():
+        yield element
+
+
+def discard_element(element):
+    # free an already processed element and everything parsed before it
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def get_hidden_inputs(form):
+    return {hidden_input.get("name"): hidden_input.get("value", "") for hidden_input in HIDDEN_INPUTS_XPATH(form)}
+
+
+def get_node_hidden_inputs(node):
+    # the type is compared exactly in Python, as the CSS attribute selector would match it case-insensitively
+    return {hidden_input.attributes['name']: hidden_input.attributes.get('value') or ''
+            for hidden_input in node.css('input[name]')
+            if hidden_input.attributes.get('type') == 'hidden' and hidden_input.attributes['name']}
+
+
+def get_node_option_values(node):
+    # direct children only, like OPTION_VALUES_XPATH, so options inside an <optgroup> are skipped on both backends
+    return [child.attributes['value'] for child in node.iter()
+            if child.tag == 'option' and child.attributes.get('value') is not None]
+
+
+def extract_login_form(response):
+    if LexborHTMLParser is not None:
+        form = LexborHTMLParser(decode_html(response)).css_first('form#login_form')
+        if form is None:
+            return None, {}
+        return form.attributes.get('action'), get_node_hidden_inputs(form)
+
+    for form in iter_html_elements(response, 'form'):
+        if form.get('id') == 'login_form':
+            return form.get('action'), get_hidden_inputs(form)
+        discard_element(form)
+    return None, {}
+
+
+def extract_dump_form(response):
+    if LexborHTMLParser is not None:
+        page = LexborHTMLParser(decode_html(response))
+        form = page.css_first('form[name="dump"]')
+        if form is None:
+            raise ValueError("Could not find the export form.")
+        dbs_select = page.css_first('select[name="db_select[]"]')
+        compression_select = page.css_first('select[name="compression"]')
+        return (form.attributes.get('action'), get_node_hidden_inputs(form),
+                get_node_option_values(dbs_select) if dbs_select is not None else [],
+                get_node_option_values(compression_select) if compression_select is not None else [])
+
+    dump_form = dbs_available = None
+    compressions_available = []
+    for element in iter_html_elements(response, ('form', 'select')):
+        if element.tag == 'select':
+            if element.get('name') == 'db_select[]':
+                dbs_available = OPTION_VALUES_XPATH(element)
+            elif element.get('name') == 'compression':
+                compressions_available = OPTION_VALUES_XPATH(element)
+        elif element.get('name') == 'dump':
+            dump_form = element.get('action'), get_hidden_inputs(element)
+        else:
+            discard_element(element)
+
+        if dump_form is not None and dbs_available is not None:
+            break
+
+    if dump_form is None:
+        raise ValueError("Could not find the export form.")
+    return dump_form + (dbs_available or [], compressions_available)
+
+
+def iter_download_chunks(session, response, timeout, max_resumes=DOWNLOAD_MAX_RESUMES):
+    # an interrupted download is continued with a Range request only if a strong ETag identifies the
+    # content: phpMyAdmin generates a new dump on every request, so without it the remaining bytes could
+    # come from a different export; a transparently decoded body is not resumed either (offsets would not match)
+    etag = response.headers.get('ETag', '')
+    resumable = (response.headers.get('Accept-Ranges') == 'bytes' and 'Content-Encoding' not in response.headers
+                 and etag.startswith('"'))
+    received = resumes = 0
+    while True:
+        # read the urllib3 response directly, iter_content() only adds per-chunk bookkeeping on top of it;
+        # read1() returns what has arrived, so an interruption does not discard a partially read block
+        response.raw.decode_content = True
+        try:
+            for chunk in iter(lambda: response.raw.read1(DOWNLOAD_CHUNK_SIZE), b''):
+                received += len(chunk)
+                yield chunk
+            return
+        except (ProtocolError, ReadTimeoutError):
+            if not resumable or resumes >= max_resumes:
+                raise
+            resumes += 1
+            response.close()
+
+        print(f'Download interrupted after {received} bytes, resuming', file=sys.stderr)
+        resume_request = response.request.copy()
+        resume_request.headers['Range'] = f'bytes={received}-'
+        resume_request.headers['If-Range'] = etag
+        response = session.send(resume_request, timeout=timeout, stream=True)
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code != 206 or not content_range.startswith(f'bytes {received}-'):
+            response.close()
+            raise ValueError(f"Could not resume the download after {received} bytes.")
+
+
+def peek_chunks(chunks, size):
+    # returns at least the first size bytes (unless the data is shorter) and an iterator over all of the data
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+    return head, itertools.chain((head,), chunks)
+
+
+def gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            if decompressor.eof:
+                # a gzip file may consist of several concatenated members and be padded with zeroes
+                chunk = chunk.lstrip(b'\0')
+                if not chunk:
+                    break
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise ValueError(f"Could not decompress the downloaded SQL dump: {e}") from e
+            yield data
+            chunk = decompressor.unused_data
+
+    if not decompressor.eof:
+        raise ValueError("The downloaded SQL dump is incomplete (gzip data ended early).")
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def url_joiner(base_url):
+    # resolves the plain absolute-path / relative links phpMyAdmin emits against a base url parsed only once;
+    # anything else (absolute, scheme-relative, query-only or fragment links, dot or empty segments, whitespace,
+    # or a base url that needs normalizing itself) goes through urljoin
+    base = urlsplit(base_url)
+    base_root = f'{base.scheme}://{base.netloc}'
+    base_dir = base_root + base.path[:base.path.rfind('/') + 1] if base.path else base_root + '/'
+    plain_base = (base.scheme in ('http', 'https') and base.netloc and not UNSAFE_BASE_URL_RE.search(base_url)
+                  and '/.' not in base.path and '//' not in base.path)
+
+    def join(ref):
+        if plain_base and PLAIN_URL_REF_RE.match(ref):
+            return base_root + ref if ref.startswith('/') else base_dir + ref
+        return urljoin(base_url, ref)
+
+    return join
+
+
+def get_content_disposition_filename(content_disposition):
+    _, _, rest = content_disposition.partition('filename="')
+    filename, _, _ = rest.partition('"')
+    if filename:
+        return filename
+
+    # RFC 5987 encoded form, e.g. filename*=UTF-8''localhost.sql
+    re_match = CONTENT_DISPOSITION_FILENAME_EXT_RE.search(content_disposition)
+    if re_match:
+        try:
+            filename = unquote(re_match.group('filename'), encoding=re_match.group('charset'), errors='strict')
+        except (LookupError, UnicodeDecodeError):
+            return None
+        # percent-decoding must not smuggle in path separators
+        return os.path.basename(filename) or None
+    return None
+
+
+def get_login_error(content):
+    re_match = LOGIN_ERROR_RE.search(content)
+    if not re_match:
+        return None
+    message = HTML_TAG_RE.sub(b' ', re_match.group('message')).decode('utf-8', 'replace')
+    return ' '.join(html.unescape(message).split()) or None
+
+
+def extract_page_links(response):
+    # returns all link targets of the page and the export links of its top menu
+    if LexborHTMLParser is not None:
+        page = LexborHTMLParser(decode_html(response))
+        hrefs = [anchor.attributes['href'] for anchor in page.css('a[href]')]
+        export_urls = [href for href in (anchor.attributes['href'] for anchor in page.css('#topmenu a[href]'))
+                       if href and any(substring in href for substring in EXPORT_URL_SUBSTRINGS)]
+        return hrefs, export_urls
+
+    tree = parse_html(response)
+    return ANCHOR_HREFS_XPATH(tree), EXPORT_URL_XPATH(tree)
 
 
 def is_login_successful(tree):
-    hrefs = tree.xpath("//a/@href")
-    target_substrings = ["frame_content", "server_export.php", "index.php?route=/server/export"]
-    combinations = product(target_substrings, hrefs)
+    load_dependencies()
+    return hrefs_indicate_login(ANCHOR_HREFS_XPATH(tree))
+
 
-    return any(substring in href for substring, href in combinations)
+def hrefs_indicate_login(hrefs):
+    hrefs = "\n".join(href for href in hrefs if href)
+
+    if LOGIN_SUCCESS_HREF_AUTOMATON is not None:
+        return next(LOGIN_SUCCESS_HREF_AUTOMATON.iter(hrefs), None) is not None
+    return LOGIN_SUCCESS_HREF_RE.search(hrefs) is not None
 
 
 def download_sql_backup(url, user, password, dry_run=False, overwrite_existing=False, prepend_date=True, basename=None,
                         output_directory=os.getcwd(), exclude_dbs=None, compression='none', prefix_format=None,
-                        timeout=60, http_auth=None, server_name=None, **kwargs):
+                        timeout=60, http_auth=None, server_name=None, transfer_compression=True, **kwargs):
     prefix_format = prefix_format or DEFAULT_PREFIX_FORMAT
-    exclude_dbs = exclude_dbs.split(',') if exclude_dbs else []
+    exclude_dbs = frozenset(exclude_dbs.split(',')) if exclude_dbs else frozenset()
+    if http_auth:
+        http_auth = tuple(http_auth.split(':', 1)) if isinstance(http_auth, str) else tuple(http_auth)
+        if len(http_auth) != 2:
+            raise ValueError("--http-auth must be given as username:password")
+
+    load_dependencies()
+    join_url = url_joiner(url)
     session = requests.Session()
+    session.mount('https://', HTTP_ADAPTER)
+    session.mount('http://', HTTP_ADAPTER)
+    if http_auth:
+        session.auth = http_auth
 
     # Login
     response = session.get(url, timeout=timeout)
     if response.status_code != 200:
         raise ValueError("Failed to load the login page.")
 
-    tree = html.fromstring(response.content)
-    form_action = tree.xpath("//form[@id='login_form']/@action")
-    form_action = form_action[0] if form_action else url
+    form_action, hidden_inputs = extract_login_form(response)
+    form_action = form_action or url
 
     form_data = {
         "pma_username": user,
         "pma_password": password,
     }
+    form_data.update(hidden_inputs)
 
-    hidden_inputs = tree.xpath("//form[@id='login_form']//input[@type='hidden']")
-    for hidden_input in hidden_inputs:
-        name = hidden_input.get("name")
-        value = hidden_input.get("value", "")
-        if name:
-            form_data[name] = value
-
-    login_response = session.post(urljoin(url,form_action), data=form_data, timeout=timeout)
+    login_response = session.post(join_url(form_action), data=form_data, timeout=timeout)
 
     if login_response.status_code != 200:
         raise ValueError("Could not log in. Please check your credentials.")
 
-    tree = html.fromstring(login_response.content)
-    if not is_login_successful(tree):
-        raise ValueError("Could not log in. Please check your credentials.")
-
-    # Extract export URL
-    export_url = tree.xpath("id('topmenu')//a[contains(@href,'server_export.php')]/@href")
-    if not export_url:
-        export_url = tree.xpath("id('topmenu')//a[contains(@href,'index.php?route=/server/export')]/@href")
-    if not export_url:
-        raise ValueError("Could not find export URL.")
-    export_url = export_url[0]
-
-    # Access export page
-    export_response = session.get(urljoin(url,export_url), timeout=timeout)
-    export_tree = html.fromstring(export_response.content)
-
-
-    # Determine databases to dump
-    dbs_available = export_tree.xpath("//select[@name='db_select[]']/option/@value")
+    # phpMyAdmin only sets its auth cookie after a successful login; in that case try the export page
+    # of current versions directly instead of parsing the page returned by the login
+    dump_form = None
+    if any(cookie.name.startswith(LOGIN_COOKIE_PREFIX) for cookie in session.cookies):
+        export_response = session.get(join_url(DEFAULT_EXPORT_URL), timeout=timeout)
+        if export_response.status_code == 200:
+            try:
+                dump_form = extract_dump_form(export_response)
+            except ValueError:
+                pass
+
+    if dump_form is None:
+        # a failed login returns the login form again, which a plain byte scan finds without building a tree
+        if LOGIN_FORM_MARKER_RE.search(login_response.content):
+            login_error = get_login_error(login_response.content)
+            raise ValueError("Could not log in. Please check your credentials."
+                             + (f" phpMyAdmin reported: {login_error}" if login_error else ""))
+
+        hrefs, export_url = extract_page_links(login_response)
+        if not hrefs_indicate_login(hrefs):
+            raise ValueError("Could not log in. Please check your credentials.")
+
+        # Extract export URL
+        if not export_url:
+            raise ValueError("Could not find export URL.")
+        export_url = export_url[0]
+
+        # Access export page
+        export_response = session.get(join_url(export_url), timeout=timeout)
+        dump_form = extract_dump_form(export_response)
+
+    dump_form_action, dump_hidden_inputs, dbs_available, compressions_available = dump_form
+
+    # Determine databases to dump (phpMyAdmin occasionally lists a database twice)
+    dbs_available = list(dict.fromkeys(dbs_available))
     dbs_to_dump = [db_name for db_name in dbs_available if db_name not in exclude_dbs]
     if not dbs_to_dump:
         print(f'Warning: no databases to dump (databases available: "{", ".join(dbs_available)}")',
               file=sys.stderr)
 
     # Prepare form data
-    dump_form_action = export_tree.xpath("//form[@name='dump']/@action")[0]
     form_data = {'db_select[]': dbs_to_dump}
-    form_data['compression'] = compression
+    # a plain dump is requested gzipped if the server supports it and decompressed while saving
+    gunzip = transfer_compression and compression == 'none' and 'gzip' in compressions_available
+    form_data['compression'] = 'gzip' if gunzip else compression
     form_data['what'] = 'sql'
     form_data['filename_template'] = '@SERVER@'
     form_data['sql_structure_or_data'] = 'structure_and_data'
-    dump_hidden_inputs = export_tree.xpath("//form[@name='dump']//input[@type='hidden']")
-    for hidden_input in dump_hidden_inputs:
-        name = hidden_input.get("name")
-        value = hidden_input.get("value", "")
-        if name:
-            form_data[name] = value
+    form_data.update(dump_hidden_inputs)
 
     # Submit form and download file
-    file_response = session.post(urljoin(url, dump_form_action), data=form_data, timeout=timeout, stream=True)
+    file_response = session.post(join_url(dump_form_action), data=form_data, timeout=timeout, stream=True)
     content_disposition = file_response.headers.get('Content-Disposition', '')
-    re_match = CONTENT_DISPOSITION_FILENAME_RE.match(content_disposition)
-    if not re_match:
+    content_filename = get_content_disposition_filename(content_disposition)
+    if not content_filename:
         raise ValueError(f"Could not determine SQL backup filename from {content_disposition}")
 
-    content_filename = re_match.group('filename')
+    chunks = iter_download_chunks(session, file_response, timeout)
+    if gunzip:
+        # decide from the data whether the server honoured the gzip request, the filename may not tell
+        head, chunks = peek_chunks(chunks, len(GZIP_MAGIC))
+        gunzip = head.startswith(GZIP_MAGIC)
+        if gunzip and content_filename.endswith('.gz'):
+            content_filename = content_filename[:-len('.gz')]
     filename = content_filename if basename is None else basename + os.path.splitext(content_filename)[1]
     if prepend_date:
-        prefix = datetime.datetime.utcnow().strftime(prefix_format)
+        prefix = datetime.datetime.now(datetime.timezone.utc).strftime(prefix_format)
         filename = prefix + filename
     out_filename = os.path.join(output_directory, filename)
 
     if os.path.isfile(out_filename) and not overwrite_existing:
-        basename, ext = os.path.splitext(out_filename)
-        n = 1
         print(f'File {out_filename} already exists, to overwrite it use --overwrite-existing', file=sys.stderr)
-        while True:
-            alternate_out_filename = f'{basename}_({n}){ext}'
-            if not os.path.isfile(alternate_out_filename):
-                out_filename = alternate_out_filename
-                break
-            n += 1
+        # list the directory once and continue after the highest number already taken
+        out_dirname, out_basename = os.path.split(out_filename)
+        file_root, ext = os.path.splitext(out_basename)
+        numbered_re = re.compile(re.escape(file_root) + r'_\((\d+)\)' + re.escape(ext) + r'\Z')
+        taken = [int(re_match.group(1)) for re_match in map(numbered_re.match, os.listdir(out_dirname or os.curdir))
+                 if re_match]
+        n = max(taken) + 1 if taken else 1
+        out_filename = os.path.join(out_dirname, f'{file_root}_({n}){ext}')
 
     # Save file if not dry run
     if not dry_run:
-        with open(out_filename, 'wb') as f:
-            for chunk in file_response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        fd = os.open(out_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        preallocated = False
+        written = 0
+        try:
+            content_length = file_response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) and hasattr(os, 'posix_fallocate'):
+                # reserve the space up front so the file system can lay the dump out contiguously
+                try:
+                    os.posix_fallocate(fd, 0, int(content_length))
+                    preallocated = True
+                except OSError:
+                    pass
+
+            for chunk in gunzip_chunks(chunks) if gunzip else chunks:
+                write_all(fd, chunk)
+                written += len(chunk)
+        finally:
+            try:
+                if preallocated:
+                    # drop reserved space that was not written, e.g. after an aborted download
+                    os.ftruncate(fd, written)
+            finally:
+                os.close(fd)
 
     return out_filename
 
 
 if __name__ == '__main__':
+    import argparse
+
     parser = argparse.ArgumentParser(
         description='Automates the download of SQL dump backups via a phpMyAdmin web interface.',
         epilog='Written by Christoph Haunschmidt et al., version: {}'.format(__version__))
@@ -172,6 +547,10 @@ if __name__ == '__main__':
                         help='mysql server hostname to supply if enabled as field on login page')
     parser.add_argument('--compression', default='none', choices=['none', 'zip', 'gzip'],
                         help='compression method for the output file - must be supported by the server (default: %(default)s)')
+    parser.add_argument('--no-transfer-compression', dest='transfer_compression', action='store_false',
+                        default=True,
+                        help='with --compression none, do not download the dump gzip-compressed from the server '
+                             '(it is decompressed while saving otherwise)')
     parser.add_argument('--basename', default=None,
                         help='the desired basename (without extension) of the SQL dump file (default: the name given '
                              'by phpMyAdmin); you can also set an empty basename "" in combination with '
@@ -195,6 +574,12 @@ if __name__ == '__main__':
         print('Error: --prefix-format given without --prepend-date', file=sys.stderr)
         sys.exit(2)
 
+    try:
+        datetime.datetime.now(datetime.timezone.utc).strftime(args.prefix_format or DEFAULT_PREFIX_FORMAT)
+    except ValueError as e:
+        print('Error: invalid --prefix-format: {}'.format(e), file=sys.stderr)
+        sys.exit(2)
+
     try:
         dump_fn = download_sql_backup(**vars(args))
     except Exception as e: